@@ -5,13 +5,32 @@ Monitors Pokemon Center's product listings and posts notifications to Discord.
 """
 
 import discord
-from discord.ext import commands, tasks
-import requests
-import json
+from discord.ext import commands
+import aiohttp
+from aiohttp import web
+from aiolimiter import AsyncLimiter
+import ijson
+import orjson
 import asyncio
+import hmac
 from datetime import datetime
+from operator import itemgetter
 from pathlib import Path
 import os
+import sqlite3
+
+# Fields pulled from each product in a single C-level lookup
+get_product_fields = itemgetter('id', 'name', 'price', 'url', 'image', 'description')
+
+# Placeholder values used when the feed omits a field
+LISTING_DEFAULTS = {'name': 'Unknown', 'price': 'N/A', 'url': '', 'image': '', 'description': ''}
+
+FETCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json'
+}
+FOOTER_ICON = "https://i.imgur.com/AfFp7pu.png"
+FOOTER = {'text': "Pokemon Center Monitor", 'icon_url': FOOTER_ICON}
 
 class PokemonCenterBot(commands.Bot):
     def __init__(self):
@@ -25,155 +44,568 @@ class PokemonCenterBot(commands.Bot):
         )
         
         # Configuration
-        self.cache_file = Path("pokemon_center_cache.json")
+        self.cache_file = Path("pokemon_center_cache.db")
+        self.legacy_cache_file = Path("pokemon_center_cache.json")
+        self.db = self.open_cache_db()
+        self.stored_ids = set()  # IDs currently written to the cache database
         self.previous_listings = self.load_cache()
+        # Keys of previous_listings, kept as a plain set for membership tests.
+        # Updated whenever listings are adopted, even if the cache write later fails.
+        self.previous_ids = set(self.previous_listings)
+        self.listings_hash = hash(frozenset(self.stored_ids))  # Key set last written to disk
         self.api_url = "https://www.pokemoncenter.com/api/products"  # UPDATE THIS
+        self.detail_url = None  # e.g. "https://www.pokemoncenter.com/api/products/{product_id}"
+        self.detail_concurrency = 10  # Max detail requests in flight at once
         self.check_interval = 300  # 5 minutes in seconds
         self.notification_channel_id = None  # Will be set via command
+        self.send_limiter = AsyncLimiter(5, 2)  # 5 messages per 2 seconds
+        self.tick_lock = None  # Held while a check is fetching and posting, created in setup_hook
+        self.poll_task = None  # Background polling task, started in setup_hook
+        self.poll_wakeup = None  # Set to make the polling task pick up a new interval
+        self.cache_write = None  # Most recent save_cache running in the executor
+        self.session = None  # aiohttp session, created in setup_hook
+        self.connector = None
+        self.etag = None  # Validators for the listings currently adopted as previous_listings
+        self.last_modified = None
+        self.pending_validators = None  # Validators from the last fetch, until its listings are adopted
         
+        # Webhook configuration (push notifications with polling as fallback)
+        self.webhook_mode = False
+        self.webhook_url = None  # Public URL registered via command
+        self.webhook_port = int(os.getenv('WEBHOOK_PORT', '8080'))
+        self.webhook_secret = os.getenv('WEBHOOK_SECRET')
+        self.webhook_fallback_interval = 3600  # Poll at most hourly in webhook mode
+        self.last_webhook_event = None
+        self.web_runner = None
+        
+    def open_cache_db(self):
+        """Open the SQLite cache database, creating the schema if needed."""
+        try:
+            return self.connect_cache_db()
+        except sqlite3.DatabaseError as e:
+            # Locked or unreadable databases are not corrupt, so let those errors surface
+            if not self.is_cache_corrupt(e):
+                raise
+            print("Cache database corrupted, starting fresh")
+            self.move_corrupt_cache_aside()
+            return self.connect_cache_db()
+    
+    def is_cache_corrupt(self, error):
+        """Return True if a SQLite error means the cache file itself is damaged."""
+        code = getattr(error, 'sqlite_errorcode', None)  # Python 3.11+
+        if code is not None:
+            return code & 0xff in (sqlite3.SQLITE_NOTADB, sqlite3.SQLITE_CORRUPT)
+        return not isinstance(error, sqlite3.OperationalError)
+    
+    def move_corrupt_cache_aside(self):
+        """Rename the cache database and its WAL files so a fresh one can be created."""
+        corrupt_file = self.cache_file.with_suffix('.db.corrupt')
+        for suffix in ('', '-wal', '-shm'):
+            path = Path(f"{self.cache_file}{suffix}")
+            if path.exists():
+                os.replace(path, Path(f"{corrupt_file}{suffix}"))
+    
+    def connect_cache_db(self):
+        """Connect to the cache database and apply the schema and pragmas."""
+        # Writes happen in worker threads, serialized by tick_lock
+        db = sqlite3.connect(self.cache_file, check_same_thread=False)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS listings(id TEXT PRIMARY KEY, data BLOB)")
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+    
     def load_cache(self):
-        """Load previously seen listings from cache file."""
-        if self.cache_file.exists():
+        """Load previously seen listings from the cache database."""
+        try:
+            rows = self.db.execute("SELECT id, data FROM listings").fetchall()
+        except sqlite3.DatabaseError as e:
+            if not self.is_cache_corrupt(e):
+                raise
+            print("Cache database corrupted, starting fresh")
+            self.db.close()
+            self.move_corrupt_cache_aside()
+            self.db = self.connect_cache_db()
+            rows = []
+        
+        listings = {}
+        bad_ids = []
+        for product_id, data in rows:
             try:
-                with open(self.cache_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("Cache file corrupted, starting fresh")
+                listings[product_id] = orjson.loads(data)
+            except orjson.JSONDecodeError:
+                bad_ids.append(product_id)
+        self.stored_ids = set(listings)
+        
+        # Drop unreadable rows but still treat those products as seen, so they
+        # aren't re-announced and get rewritten on the next cache update
+        if bad_ids:
+            print(f"Dropping {len(bad_ids)} unreadable cached listing(s)")
+            with self.db:
+                self.db.executemany("DELETE FROM listings WHERE id = ?", [(product_id,) for product_id in bad_ids])
+            for product_id in bad_ids:
+                listings[product_id] = {}
+        
+        # One-time import of the old JSON cache so upgrading doesn't re-announce everything
+        if not listings and self.legacy_cache_file.exists():
+            try:
+                with open(self.legacy_cache_file, 'rb') as f:
+                    listings = orjson.loads(f.read())
+                self.save_cache(listings)
+                self.legacy_cache_file.unlink()
+                print(f"Imported {len(listings)} listings from {self.legacy_cache_file}")
+            except orjson.JSONDecodeError:
+                print("Legacy cache file corrupted, starting fresh")
                 return {}
-        return {}
+        
+        return listings
     
     def save_cache(self, listings):
-        """Save current listings to cache file."""
-        with open(self.cache_file, 'w') as f:
-            json.dump(listings, f, indent=2)
+        """Sync the cache database with current listings, touching only changed rows."""
+        added = listings.keys() - self.stored_ids
+        removed = self.stored_ids - listings.keys()
+        
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO listings VALUES (?, ?)",
+                [(product_id, orjson.dumps(listings[product_id])) for product_id in added]
+            )
+            self.db.executemany(
+                "DELETE FROM listings WHERE id = ?",
+                [(product_id,) for product_id in removed]
+            )
+        
+        self.stored_ids = set(listings)
+        self.listings_hash = hash(frozenset(listings))
+    
+    async def persist_cache(self, listings):
+        """Save listings in a worker thread so disk IO doesn't block the event loop."""
+        # A write left running by a cancelled caller must finish before the next one starts
+        if self.cache_write and not self.cache_write.done():
+            await asyncio.wait([self.cache_write])
+        
+        loop = asyncio.get_running_loop()
+        self.cache_write = loop.run_in_executor(None, self.save_cache, listings)
+        
+        # Shielded so cancelling the caller doesn't cancel our handle on the running write
+        try:
+            await asyncio.shield(self.cache_write)
+        except asyncio.CancelledError:
+            # Keep the caller, and the tick_lock it holds, until the thread is done
+            await asyncio.wait([self.cache_write])
+            raise
     
     async def fetch_listings(self):
         """Fetch current listings from Pokemon Center."""
+        self.pending_validators = None
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json'
-            }
+            # Conditional GET so an unchanged catalog comes back as an empty 304
+            headers = {}
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
             
-            # Use asyncio to avoid blocking
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.get(self.api_url, headers=headers, timeout=10)
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Process the response - adjust based on actual API structure
-            listings = {}
-            if isinstance(data, dict) and 'products' in data:
-                for product in data.get('products', []):
-                    product_id = product.get('id') or product.get('sku')
-                    listings[product_id] = {
-                        'name': product.get('name', 'Unknown'),
-                        'price': product.get('price', 'N/A'),
-                        'url': product.get('url', ''),
-                        'image': product.get('image', ''),
-                        'description': product.get('description', ''),
-                        'timestamp': datetime.now().isoformat()
-                    }
+            async with self.session.get(self.api_url, headers=headers) as resp:
+                if resp.status == 304:
+                    return self.previous_listings
+                
+                resp.raise_for_status()
+                
+                # Stream products out of the body instead of materializing the whole catalog
+                listings = {}
+                timestamp = datetime.now().isoformat()
+                async for product in ijson.items_async(resp.content, 'products.item', use_float=True):
+                    self.add_listing(listings, product, timestamp)
+                
+                etag = resp.headers.get('ETag')
+                last_modified = resp.headers.get('Last-Modified')
             
+            # Callers commit these once they adopt the listings as previous_listings
+            self.pending_validators = (etag, last_modified)
             return listings
             
         except Exception as e:
             print(f"Error fetching listings: {e}")
             return None
     
+    def commit_validators(self):
+        """Use the last fetch's validators for future conditional GETs."""
+        if self.pending_validators:
+            self.etag, self.last_modified = self.pending_validators
+            self.pending_validators = None
+    
+    def parse_listings(self, data):
+        """Convert a product feed payload into a dict of listings keyed by product ID."""
+        # Process the response - adjust based on actual API structure
+        listings = {}
+        if isinstance(data, dict) and 'products' in data:
+            timestamp = datetime.now().isoformat()
+            for product in data.get('products', []):
+                self.add_listing(listings, product, timestamp)
+        
+        return listings
+    
+    def add_listing(self, listings, product, timestamp):
+        """Add a single product from the feed to listings, keyed by product ID."""
+        try:
+            product_id, name, price, url, image, description = get_product_fields(product)
+        except KeyError:
+            # Slow path with defaults for products missing some fields
+            product_id = product.get('id')
+            name = product.get('name', 'Unknown')
+            price = product.get('price', 'N/A')
+            url = product.get('url', '')
+            image = product.get('image', '')
+            description = product.get('description', '')
+        
+        product_id = product_id or product.get('sku')
+        if product_id is None:
+            return
+        listings[str(product_id)] = {
+            'id': str(product_id),
+            'name': name,
+            'price': price,
+            'url': url,
+            'image': image,
+            'description': description,
+            'timestamp': timestamp
+        }
+    
     def find_new_listings(self, current_listings):
         """Compare current listings with cached listings to find new items."""
         if current_listings is None:
             return []
         
-        new_items = []
-        for product_id, product_info in current_listings.items():
-            if product_id not in self.previous_listings:
-                new_items.append(product_info)
-        
-        return new_items
-    
-    async def send_discord_notification(self, channel, new_items):
-        """Send notification about new listings to Discord channel."""
-        if not new_items or not channel:
-            return
+        new_keys = current_listings.keys() - self.previous_ids
+        if not new_keys:
+            return []
         
+        # Keep the feed's ordering for notifications
+        return [info for product_id, info in current_listings.items() if product_id in new_keys]
+    
+    def build_embeds(self, new_items):
+        """Build a notification embed for each new item."""
+        embeds = []
+        timestamp = datetime.now().astimezone().isoformat()
+        color = discord.Color.red().value  # Pokemon red
         for item in new_items:
-            # Create embed for each new item
-            embed = discord.Embed(
-                title="🎮 New Pokemon Center Listing!",
-                description=item['name'],
-                color=discord.Color.red(),  # Pokemon red
-                timestamp=datetime.now(),
-                url=item.get('url', '')
-            )
-            
             # Add fields
+            fields = []
             if item.get('price') != 'N/A':
-                embed.add_field(name="💰 Price", value=str(item['price']), inline=True)
+                fields.append({'name': "💰 Price", 'value': str(item['price']), 'inline': True})
             
             if item.get('url'):
-                embed.add_field(name="🔗 Link", value=f"[View Product]({item['url']})", inline=True)
+                fields.append({'name': "🔗 Link", 'value': f"[View Product]({item['url']})", 'inline': True})
             
-            if item.get('description'):
-                description = item['description'][:200]
-                if len(item['description']) > 200:
-                    description += "..."
-                embed.add_field(name="📝 Description", value=description, inline=False)
+            desc = item.get('description', '')
+            if desc:
+                description = desc if len(desc) <= 200 else desc[:200] + "..."
+                fields.append({'name': "📝 Description", 'value': description, 'inline': False})
+            
+            # Create embed for each new item in one go rather than chained setters
+            data = {
+                'title': "🎮 New Pokemon Center Listing!",
+                'description': item['name'],
+                'color': color,
+                'timestamp': timestamp,
+                'fields': fields,
+                'footer': FOOTER.copy()
+            }
+            if item.get('url'):
+                data['url'] = item['url']
             
             # Add thumbnail if available
             if item.get('image'):
-                embed.set_thumbnail(url=item['image'])
+                data['thumbnail'] = {'url': item['image']}
             
-            # Add footer
-            embed.set_footer(text="Pokemon Center Monitor", icon_url="https://i.imgur.com/AfFp7pu.png")
+            embeds.append(discord.Embed.from_dict(data))
+        
+        return embeds
+    
+    async def fetch_product_details(self, new_items):
+        """Fill in fields missing from the product feed using the detail endpoint."""
+        if not self.detail_url:
+            return
+        
+        stubs = [
+            item for item in new_items
+            if 'id' in item and any(item.get(key) == default for key, default in LISTING_DEFAULTS.items())
+        ]
+        if not stubs:
+            return
+        
+        # Cap concurrency so large drops don't trip the storefront's rate limits
+        semaphore = asyncio.Semaphore(self.detail_concurrency)
+        
+        async def fetch_one(item):
+            async with semaphore:
+                try:
+                    url = self.detail_url.format(product_id=item['id'])
+                    async with self.session.get(url) as resp:
+                        resp.raise_for_status()
+                        return orjson.loads(await resp.read())
+                except Exception as e:
+                    print(f"Error fetching details for {item['id']}: {e}")
+                    return None
+        
+        results = await asyncio.gather(*[fetch_one(item) for item in stubs])
+        
+        for item, product in zip(stubs, results):
+            # Process the response - adjust based on actual API structure
+            if isinstance(product, dict) and 'product' in product:
+                product = product['product']
+            if not isinstance(product, dict):
+                continue
             
+            details = {}
+            self.add_listing(details, {**product, 'id': item['id']}, item['timestamp'])
+            detail = details[item['id']]
+            for key, default in LISTING_DEFAULTS.items():
+                if item.get(key) == default:
+                    item[key] = detail[key]
+    
+    async def send_discord_notification(self, channel, new_items):
+        """Send notification about new listings to Discord channel."""
+        if not new_items or not channel:
+            return
+        
+        # Large drops are built in a worker thread to keep the event loop responsive
+        if len(new_items) > 10:
+            loop = asyncio.get_running_loop()
+            embeds = await loop.run_in_executor(None, self.build_embeds, new_items)
+        else:
+            embeds = self.build_embeds(new_items)
+        
+        # Discord allows up to 10 embeds and 6000 embed characters per message
+        batches = []
+        batch, batch_chars = [], 0
+        for embed in embeds:
+            if batch and (len(batch) == 10 or batch_chars + len(embed) > 6000):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(embed)
+            batch_chars += len(embed)
+        if batch:
+            batches.append(batch)
+        
+        for batch in batches:
             try:
-                await channel.send(embed=embed)
-                await asyncio.sleep(1)  # Avoid rate limiting
+                await self.send_rate_limited(channel, embeds=batch)
             except Exception as e:
                 print(f"Error sending Discord message: {e}")
     
-    @tasks.loop(seconds=300)  # Default 5 minutes
+    async def send_rate_limited(self, channel, **kwargs):
+        """Send a message through the token bucket, backing off once if Discord returns 429."""
+        try:
+            async with self.send_limiter:
+                return await channel.send(**kwargs)
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            retry_after = float(e.response.headers.get('Retry-After', 1))
+            print(f"Rate limited by Discord, retrying in {retry_after:.1f}s")
+            await asyncio.sleep(retry_after)
+            async with self.send_limiter:
+                return await channel.send(**kwargs)
+    
     async def check_for_new_listings(self):
-        """Background task to check for new listings."""
+        """Run a single check for new listings and notify the configured channel."""
         if not self.notification_channel_id:
             return
         
+        # In webhook mode, only poll as a safety net when events have gone quiet
+        if self.webhook_mode and self.last_webhook_event:
+            elapsed = (datetime.now() - self.last_webhook_event).total_seconds()
+            if elapsed < self.webhook_fallback_interval:
+                return
+        
         channel = self.get_channel(self.notification_channel_id)
         if not channel:
             return
         
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking for new listings...")
+        # Skip this tick rather than queue behind a slow previous run
+        if self.tick_lock.locked():
+            print("Previous check still running, skipping overlapping tick")
+            return
         
-        current_listings = await self.fetch_listings()
+        async with self.tick_lock:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking for new listings...")
+            
+            current_listings = await self.fetch_listings()
+            
+            if current_listings:
+                new_items = self.find_new_listings(current_listings)
+                
+                if new_items:
+                    print(f"Found {len(new_items)} new listings!")
+                    await self.fetch_product_details(new_items)
+                    await self.send_discord_notification(channel, new_items)
+                else:
+                    print("No new listings found")
+                
+                # Update cache, skipping the write when the set of products is unchanged
+                self.previous_listings = current_listings
+                self.previous_ids = set(current_listings)
+                self.commit_validators()
+                if hash(frozenset(current_listings)) != self.listings_hash:
+                    await self.persist_cache(current_listings)
+    
+    async def poll_forever(self):
+        """Background task that checks for new listings every check_interval seconds."""
+        await self.wait_until_ready()
         
-        if current_listings:
-            new_items = self.find_new_listings(current_listings)
+        while not self.is_closed():
+            try:
+                await self.check_for_new_listings()
+            except Exception as e:
+                print(f"Error checking for new listings: {e}")
+            
+            await self.wait_for_next_poll()
+    
+    async def wait_for_next_poll(self):
+        """Sleep until the next check, restarting the wait when the polling mode or interval changes."""
+        while True:
+            self.poll_wakeup.clear()
             
-            if new_items:
-                print(f"Found {len(new_items)} new listings!")
-                await self.send_discord_notification(channel, new_items)
+            # Keep polling as a safety net in webhook mode, just far less often
+            if self.webhook_mode:
+                interval = max(self.check_interval, self.webhook_fallback_interval)
             else:
-                print("No new listings found")
+                interval = self.check_interval
             
-            # Update cache
-            self.previous_listings = current_listings
-            self.save_cache(current_listings)
+            try:
+                await asyncio.wait_for(self.poll_wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                return
+    
+    async def handle_webhook(self, request):
+        """Handle a product feed event pushed to the webhook endpoint."""
+        if not self.webhook_mode:
+            return web.Response(status=404)
+        
+        provided = request.headers.get('X-Webhook-Secret', '')
+        if not hmac.compare_digest(provided.encode(), self.webhook_secret.encode()):
+            return web.Response(status=401)
+        
+        try:
+            payload = orjson.loads(await request.read())
+        except Exception:
+            payload = None
+        
+        self.last_webhook_event = datetime.now()
+        
+        channel = self.get_channel(self.notification_channel_id) if self.notification_channel_id else None
+        if not channel:
+            return web.Response(status=202)
+        
+        print(f"[{self.last_webhook_event.strftime('%Y-%m-%d %H:%M:%S')}] Webhook event received")
+        
+        async with self.tick_lock:
+            # Events carrying products are diffed directly, anything else triggers a fetch
+            fetched = not (isinstance(payload, dict) and 'products' in payload)
+            if fetched:
+                event_listings = current_listings = await self.fetch_listings()
+            else:
+                event_listings = self.parse_listings(payload)
+                current_listings = {**self.previous_listings, **event_listings}
+            
+            if current_listings:
+                new_items = self.find_new_listings(event_listings)
+                
+                if new_items:
+                    print(f"Found {len(new_items)} new listings!")
+                    await self.fetch_product_details(new_items)
+                    await self.send_discord_notification(channel, new_items)
+                
+                # Update cache
+                self.previous_listings = current_listings
+                self.previous_ids = set(current_listings)
+                if fetched:
+                    self.commit_validators()
+                await self.persist_cache(current_listings)
+        
+        return web.Response(status=204)
     
-    @check_for_new_listings.before_loop
-    async def before_check_for_new_listings(self):
-        """Wait until bot is ready before starting the loop."""
-        await self.wait_until_ready()
+    async def start_webhook_server(self):
+        """Start the webhook listener if it is not already running."""
+        if self.web_runner:
+            return
+        
+        # Never expose an unauthenticated endpoint that can post to the channel
+        if not self.webhook_secret:
+            raise RuntimeError("WEBHOOK_SECRET must be set to enable the webhook listener")
+        
+        app = web.Application()
+        app.router.add_post('/webhook/pokemoncenter', self.handle_webhook)
+        
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            site = web.TCPSite(runner, '0.0.0.0', self.webhook_port)
+            await site.start()
+        except Exception:
+            await runner.cleanup()
+            raise
+        
+        # Only mark the listener as running once the port is actually bound
+        self.web_runner = runner
+        print(f"Webhook listener started on port {self.webhook_port}")
     
     async def setup_hook(self):
         """Setup hook called when bot starts."""
+        # Pooled keep-alive connections so polls reuse the same TLS session
+        self.connector = aiohttp.TCPConnector(
+            limit=10,
+            keepalive_timeout=300,
+            ttl_dns_cache=600,
+            enable_cleanup_closed=True
+        )
+        
+        # Shared HTTP session for Pokemon Center requests
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            headers=FETCH_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+        
+        # Created here so it binds to the running event loop on Python 3.8/3.9
+        self.tick_lock = asyncio.Lock()
+        self.poll_wakeup = asyncio.Event()
+        
         # Start the background task
-        self.check_for_new_listings.start()
+        self.poll_task = asyncio.create_task(self.poll_forever())
+    
+    async def close(self):
+        """Stop background work and close the HTTP session, connection pool and cache database."""
+        if self.poll_task:
+            self.poll_task.cancel()
+            try:
+                await self.poll_task
+            except asyncio.CancelledError:
+                pass
+        if self.web_runner:
+            await self.web_runner.cleanup()
+        if self.session:
+            await self.session.close()
+        if self.connector:
+            await self.connector.close()
+        
+        # Hold tick_lock so no new write starts, and let any in-flight write finish
+        if self.tick_lock:
+            async with self.tick_lock:
+                if self.cache_write:
+                    try:
+                        await self.cache_write
+                    except Exception as e:
+                        print(f"Error saving cache: {e}")
+                self.db.close()
+        else:
+            self.db.close()
+        await super().close()
 
 
 # Create bot instance
@@ -189,6 +621,16 @@ async def on_ready():
     print('------')
 
 
+@bot.event
+async def on_command_error(ctx, error):
+    """Tell users how long to wait on cooldowns, default handling for everything else."""
+    if isinstance(error, commands.CommandOnCooldown):
+        await ctx.send(f"⏳ Please wait {error.retry_after:.0f} seconds before using this command again.")
+        return
+    
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+
 @bot.command(name='setchannel')
 @commands.has_permissions(administrator=True)
 async def set_channel(ctx):
@@ -226,6 +668,12 @@ async def status(ctx):
         inline=True
     )
     
+    embed.add_field(
+        name="Webhook",
+        value=bot.webhook_url if bot.webhook_mode else "Disabled (polling)",
+        inline=False
+    )
+    
     embed.add_field(
         name="Cached Listings",
         value=str(len(bot.previous_listings)),
@@ -234,7 +682,7 @@ async def status(ctx):
     
     embed.add_field(
         name="Monitoring Status",
-        value="🟢 Active" if bot.check_for_new_listings.is_running() else "🔴 Inactive",
+        value="🟢 Active" if bot.poll_task and not bot.poll_task.done() else "🔴 Inactive",
         inline=True
     )
     
@@ -254,7 +702,7 @@ async def set_interval(ctx, seconds: int):
         return
     
     bot.check_interval = seconds
-    bot.check_for_new_listings.change_interval(seconds=seconds)
+    bot.poll_wakeup.set()
     
     embed = discord.Embed(
         title="✅ Interval Updated",
@@ -264,38 +712,99 @@ async def set_interval(ctx, seconds: int):
     await ctx.send(embed=embed)
 
 
-@bot.command(name='check')
+@bot.command(name='webhook')
 @commands.has_permissions(administrator=True)
-async def manual_check(ctx):
-    """Manually trigger a check for new listings."""
-    await ctx.send("🔍 Checking for new listings...")
+async def set_webhook(ctx, url: str):
+    """
+    Register the public webhook URL and switch to push notifications.
+    
+    Usage: !pc webhook https://example.com/webhook/pokemoncenter
+    Use `!pc webhook off` to go back to polling.
+    """
+    if url.lower() == 'off':
+        bot.webhook_mode = False
+        bot.webhook_url = None
+        bot.poll_wakeup.set()
+        
+        embed = discord.Embed(
+            title="✅ Webhook Disabled",
+            description=f"Polling every {bot.check_interval} seconds ({bot.check_interval // 60} minutes)",
+            color=discord.Color.orange()
+        )
+        await ctx.send(embed=embed)
+        return
     
-    current_listings = await bot.fetch_listings()
+    if not url.startswith(('http://', 'https://')):
+        await ctx.send("⚠️ Webhook URL must start with http:// or https://")
+        return
     
-    if current_listings is None:
-        await ctx.send("❌ Failed to fetch listings. Check API endpoint and connection.")
+    if not bot.webhook_secret:
+        await ctx.send("⚠️ Set the WEBHOOK_SECRET environment variable before enabling webhooks.")
+        return
+    
+    try:
+        await bot.start_webhook_server()
+    except OSError as e:
+        await ctx.send(f"❌ Could not start webhook listener on port {bot.webhook_port}: {e}")
         return
     
-    new_items = bot.find_new_listings(current_listings)
+    bot.webhook_url = url
+    bot.webhook_mode = True
+    bot.last_webhook_event = datetime.now()
+    bot.poll_wakeup.set()
+    
+    embed = discord.Embed(
+        title="✅ Webhook Registered",
+        description=f"Listening for product events at {url}\n"
+                    f"Fallback polling every {bot.webhook_fallback_interval // 60} minutes",
+        color=discord.Color.green()
+    )
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='check')
+@commands.has_permissions(administrator=True)
+@commands.cooldown(1, 30, commands.BucketType.guild)
+async def manual_check(ctx):
+    """Manually trigger a check for new listings."""
+    await ctx.send("🔍 Checking for new listings...")
     
-    if new_items:
-        await ctx.send(f"✅ Found {len(new_items)} new listing(s)! Posting them now...")
-        channel = bot.get_channel(bot.notification_channel_id) if bot.notification_channel_id else ctx.channel
-        await bot.send_discord_notification(channel, new_items)
+    async with bot.tick_lock:
+        current_listings = await bot.fetch_listings()
+        
+        if current_listings is None:
+            await ctx.send("❌ Failed to fetch listings. Check API endpoint and connection.")
+            return
+        
+        new_items = bot.find_new_listings(current_listings)
         
-        # Update cache
-        bot.previous_listings = current_listings
-        bot.save_cache(current_listings)
-    else:
-        await ctx.send("✅ Check complete. No new listings found.")
+        if new_items:
+            await ctx.send(f"✅ Found {len(new_items)} new listing(s)! Posting them now...")
+            channel = bot.get_channel(bot.notification_channel_id) if bot.notification_channel_id else ctx.channel
+            await bot.fetch_product_details(new_items)
+            await bot.send_discord_notification(channel, new_items)
+        else:
+            await ctx.send("✅ Check complete. No new listings found.")
+        
+        # Update cache, same as the background check so removals are picked up too
+        if current_listings:
+            bot.previous_listings = current_listings
+            bot.previous_ids = set(current_listings)
+            bot.commit_validators()
+            if hash(frozenset(current_listings)) != bot.listings_hash:
+                await bot.persist_cache(current_listings)
 
 
 @bot.command(name='reset')
 @commands.has_permissions(administrator=True)
 async def reset_cache(ctx):
     """Reset the cache (will treat all current listings as new on next check)."""
-    bot.previous_listings = {}
-    bot.save_cache({})
+    async with bot.tick_lock:
+        bot.previous_listings = {}
+        bot.previous_ids = set()
+        bot.etag = None
+        bot.last_modified = None
+        await bot.persist_cache({})
     
     embed = discord.Embed(
         title="✅ Cache Reset",
@@ -332,9 +841,15 @@ async def help_command(ctx):
         inline=False
     )
     
+    embed.add_field(
+        name="!pc webhook <url|off>",
+        value="Receive product events via webhook, polling as fallback (Admin only)",
+        inline=False
+    )
+    
     embed.add_field(
         name="!pc check",
-        value="Manually check for new listings (Admin only)",
+        value="Manually check for new listings (Admin only, once per 30 seconds)",
         inline=False
     )
     